@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+End to end load test of GDAXSocketClient against the local simulator.
+
+    python benchmarks/gdax_feed.py --rate 5000 --seconds 30 --gap-probability 0.001
+
+Prints the messages processed per second and the resync (recovery) times
+recorded by the client's metrics.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from crypto_hub.metrics import MetricsRegistry  # noqa: E402
+from crypto_hub.gdax.simulator import GDAXSimulator  # noqa: E402
+from crypto_hub.gdax.socket_client import GDAXSocketClient  # noqa: E402
+
+
+def _total(snapshot, kind, prefix, field=None):
+    total = 0
+    for series, value in snapshot[kind].items():
+        if series.startswith(prefix + '{') or series == prefix:
+            total += value[field] if field else value
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', nargs='+', default=['BTC-USD', 'ETH-USD'])
+    parser.add_argument('--rate', type=float, default=1000, help='messages per second, 0 for max')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gap-probability', type=float, default=0.0)
+    parser.add_argument('--duplicate-probability', type=float, default=0.0)
+    parser.add_argument('--burst-interval', type=float, default=None)
+    parser.add_argument('--burst-size', type=int, default=0)
+    parser.add_argument('--prometheus', action='store_true', help='dump all metrics at the end')
+    args = parser.parse_args(argv)
+
+    simulator = GDAXSimulator(
+        products=args.products,
+        messages_per_second=args.rate or None,
+        seed=args.seed,
+        gap_probability=args.gap_probability,
+        duplicate_probability=args.duplicate_probability,
+        burst_interval=args.burst_interval,
+        burst_size=args.burst_size,
+    )
+    metrics = MetricsRegistry()
+    with simulator:
+        client = GDAXSocketClient(
+            products=args.products,
+            url=simulator.ws_url,
+            api_url=simulator.api_url,
+            metrics=metrics,
+        )
+        client.start()
+        time.sleep(args.seconds)
+        client.close()
+
+    snapshot = metrics.snapshot()
+    processed = _total(snapshot, 'counters', 'gdax_socket_messages_total')
+    resyncs = _total(snapshot, 'counters', 'gdax_resyncs_total')
+    resync_seconds = _total(snapshot, 'histograms', 'gdax_resync_seconds', 'sum')
+    print('simulator     {}'.format(simulator.stats))
+    print('processed     {} messages, {:.0f}/s'.format(processed, processed / args.seconds))
+    print('gaps          {}'.format(_total(snapshot, 'counters', 'gdax_sequence_gaps_total')))
+    print('resyncs       {} taking {:.3f}s total, {:.1f} ms mean'.format(
+        resyncs, resync_seconds, 1000 * resync_seconds / resyncs if resyncs else 0))
+    if args.prometheus:
+        print(metrics.to_prometheus())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Records the cold import time of each crypto_hub submodule.
+
+Every module is imported in a fresh interpreter so earlier imports
+don't hide the cost of shared dependencies.
+
+    python benchmarks/import_time.py --output import_times.json
+    python benchmarks/import_time.py --baseline import_times.json
+
+With --baseline the script exits non zero if any module got
+slower than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+
+HEAVY = ['pandas', 'numpy', 'logbook', 'bintrees', 'gdax']
+
+_SNIPPET = """
+import json, sys, time
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'loaded': [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def find_modules():
+    """
+    :return: list of every crypto_hub module and package name, sorted
+    """
+    sys.path.insert(0, ROOT)
+    import crypto_hub
+    names = [name for _, name, _ in pkgutil.walk_packages(crypto_hub.__path__, 'crypto_hub.')]
+    return ['crypto_hub'] + sorted(names)
+
+
+def time_import(module, repeat=5):
+    """
+    :param module: module name
+    :param repeat: number of fresh interpreters to start
+    :return: dict
+        best import time in seconds and the heavy dependencies it loaded
+    """
+    best = None
+    code = _SNIPPET.format(module=module, heavy=HEAVY)
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+        result = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+        if best is None or result['seconds'] < best['seconds']:
+            best = result
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the timings to this json file')
+    parser.add_argument('--baseline', help='compare against this json file')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown vs the baseline')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for module in find_modules():
+        try:
+            results[module] = time_import(module, repeat=args.repeat)
+        except subprocess.CalledProcessError:
+            results[module] = None
+            print('{:<36} import failed'.format(module))
+            continue
+        print('{:<36} {:8.1f} ms  loads: {}'.format(
+            module,
+            results[module]['seconds'] * 1000,
+            ', '.join(results[module]['loaded']) or '-'
+        ))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = []
+        for module, result in results.items():
+            before = baseline.get(module)
+            if not result or not before:
+                continue
+            limit = before['seconds'] * (1 + args.tolerance)
+            if result['seconds'] > limit:
+                regressions.append(module)
+                print('REGRESSION {}: {:.1f} ms -> {:.1f} ms'.format(
+                    module, before['seconds'] * 1000, result['seconds'] * 1000))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
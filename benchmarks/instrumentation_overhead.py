@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Measures the cost of the GDAX book instrumentation.
+
+Replays the same synthetic feed through a plain GDAXOrderBook and
+an instrumented one, with the socket client wrapper around it as
+GDAXSocketClient(metrics=...) sets it up, and prints the time per
+message for both.
+
+    python benchmarks/instrumentation_overhead.py --messages 50000 --repeat 10
+
+Each chunk of messages is timed separately and the fastest repeat of
+every chunk is kept, so background load doesn't swamp the difference.
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from crypto_hub.metrics import MetricsRegistry  # noqa: E402
+from crypto_hub.gdax.gdax_book import GDAXOrderBook  # noqa: E402
+from crypto_hub.gdax.instrumentation import instrument_socket_client  # noqa: E402
+from crypto_hub.gdax.simulator import SyntheticProduct  # noqa: E402
+
+
+class _SnapshotClient(object):
+    """
+    Serves a fixed level 3 snapshot in place of PublicGDAXClient.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get_product_order_book(self, product_id, level=3):
+        return self.snapshot
+
+
+class _Client(object):
+    """
+    Stands in for GDAXSocketClient.on_message, which passes messages to the book.
+    """
+
+    def __init__(self, book):
+        self.book = book
+
+    def on_message(self, msg):
+        self.book.on_message(msg)
+
+
+def _client(snapshot, metrics):
+    book = GDAXOrderBook('BTC-USD', public_client=_SnapshotClient(snapshot), metrics=metrics)
+    book.reset_book()
+    client = _Client(book)
+    if metrics is not None:
+        instrument_socket_client(client, metrics)
+    return client
+
+
+def _timed_chunk(on_message, messages):
+    start = time.time()
+    for message in messages:
+        on_message(message)
+    return time.time() - start
+
+
+def _run(snapshot, chunks):
+    """
+    :return: (plain, instrumented) seconds per chunk
+        the two books are fed alternately one chunk at a time,
+        so noise on a busy machine hits both the same way.
+    """
+    plain = _client(snapshot, None).on_message
+    instrumented = _client(snapshot, MetricsRegistry()).on_message
+    plain_times, instrumented_times = [], []
+    gc.disable()
+    try:
+        for i, chunk in enumerate(chunks):
+            # Alternate which book sees the chunk first, the first one
+            # pays for pulling the messages into the cache
+            if i % 2:
+                instrumented_times.append(_timed_chunk(instrumented, chunk))
+                plain_times.append(_timed_chunk(plain, chunk))
+            else:
+                plain_times.append(_timed_chunk(plain, chunk))
+                instrumented_times.append(_timed_chunk(instrumented, chunk))
+    finally:
+        gc.enable()
+    return plain_times, instrumented_times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--chunk', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    product = SyntheticProduct('BTC-USD', random.Random(args.seed))
+    snapshot = product.level3()
+    messages = [product.next_message() for _ in range(args.messages)]
+    chunks = [messages[i:i + args.chunk] for i in range(0, len(messages), args.chunk)]
+
+    runs = [_run(snapshot, chunks) for _ in range(args.repeat)]
+    # Fastest time of each chunk over the repeats
+    plain = sum(min(times) for times in zip(*[run[0] for run in runs]))
+    instrumented = sum(min(times) for times in zip(*[run[1] for run in runs]))
+    per_message = 1e6 / len(messages)
+    print('plain         {:.2f} us/message'.format(plain * per_message))
+    print('instrumented  {:.2f} us/message'.format(instrumented * per_message))
+    print('overhead      {:.1f}%'.format(100 * (instrumented - plain) / plain))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Columnar binary checkpoint files.
+
+Layout:
+    8 bytes   magic
+    8 bytes   little endian header length
+    header    json {'meta': {...}, 'columns': [{'name', 'dtype', 'shape', 'offset'}]}
+    columns   raw array data, each starting on a 64 byte boundary
+
+Columns are read back as read only memory maps by default, so opening
+a checkpoint costs a header parse regardless of its size.
+"""
+import os
+import json
+import struct
+
+from crypto_hub.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+MAGIC = b'CHUBCKP1'
+_ALIGN = 64
+
+# os.replace is atomic but python 3 only
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_checkpoint(path, columns, meta=None):
+    """
+    :param path: file to write, replaced atomically
+    :param columns: list of (name, array) pairs
+    :param meta: json serializable dict
+    """
+    arrays = [(name, np.ascontiguousarray(array)) for name, array in columns]
+    specs = [
+        {'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': 0}
+        for name, array in arrays
+    ]
+    # The header size depends on the offsets, leave room for them to grow
+    header = json.dumps({'meta': meta or {}, 'columns': specs}).encode('utf-8')
+    start = _aligned(len(MAGIC) + 8 + len(header) + 32 * len(specs) + 64)
+    offset = start
+    for spec, (_, array) in zip(specs, arrays):
+        spec['offset'] = offset
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({'meta': meta or {}, 'columns': specs}).encode('utf-8')
+    assert len(MAGIC) + 8 + len(header) <= start
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for spec, (_, array) in zip(specs, arrays):
+            f.seek(spec['offset'])
+            f.write(array.tobytes())
+        f.truncate(offset)
+    _replace(tmp_path, path)
+
+
+def read_checkpoint(path, mmap=True):
+    """
+    :param path: checkpoint file
+    :param mmap: memory map the columns instead of reading them
+    :return: (columns, meta)
+        columns is a dict of name -> array
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a checkpoint file'.format(path))
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        columns = {}
+        for spec in header['columns']:
+            dtype = np.dtype(spec['dtype'])
+            shape = tuple(spec['shape'])
+            count = int(np.prod(shape)) if shape else 1
+            if count == 0:
+                columns[spec['name']] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                columns[spec['name']] = np.memmap(
+                    path, dtype=dtype, mode='r', offset=spec['offset'], shape=shape)
+            else:
+                f.seek(spec['offset'])
+                columns[spec['name']] = np.fromfile(f, dtype=dtype, count=count).reshape(shape)
+    return columns, header['meta']
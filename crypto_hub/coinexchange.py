@@ -1,11 +1,16 @@
-import pandas as pd
-import numpy as np
+import time
+import threading
+
+from crypto_hub.lazy import lazy_import
 from crypto_hub.order_book import LimitOrderBook
 from crypto_hub.constants import (
     PRICE, SIDE, SIZE, TIMESTAMP,
     ORDER_ID, ORDER_SIDES
 )
 
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
 
 class CoinExchange(object):
     """
@@ -19,23 +24,114 @@ class CoinExchange(object):
     def __init__(self, refresh_minutes=10):
         self._last_refresh = pd.Timestamp('1970-01-01', tz='utc')
         self._refresh_delta = pd.Timedelta(minutes=refresh_minutes)
+        # Wait this long after a failed background refresh before retrying
+        self._retry_delta = self._refresh_delta / 10
+        self._last_failure = None
         self._data = None
+        self._market_ids = {}
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread = None
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'last_refresh_seconds': np.nan,
+            'total_refresh_seconds': 0.0,
+        }
 
     @property
     def markets(self):
         """
         Joins the summary and markets api calls into a DataFrame
+
+        Only the first call blocks on the download. Once the data
+        expires it is still served while a background thread refreshes it.
+        A failed refresh is retried after a tenth of the refresh interval.
+
         :return: DataFrame indexed by market id.
         """
+        if self._data is None:
+            self.stats['misses'] += 1
+            with self._refresh_lock:
+                if self._data is None:
+                    self._refresh()
+            return self._data
         now = pd.Timestamp.utcnow()
-        needs_refresh = (now - self._last_refresh) >= self._refresh_delta
-        if needs_refresh or self._data is None:
-            markets = self.fetch_markets()
-            quotes = self.fetch_summaries()
-            self._data = markets.join(quotes, how='outer')
-            self._last_refresh = now
+        if (now - self._last_refresh) >= self._refresh_delta:
+            self.stats['stale_hits'] += 1
+            last_failure = self._last_failure
+            if last_failure is None or (now - last_failure) >= self._retry_delta:
+                self._start_background_refresh()
+        else:
+            self.stats['hits'] += 1
         return self._data
 
+    def refresh(self):
+        """
+        Blocks until the market data has been downloaded.
+        """
+        with self._refresh_lock:
+            self._refresh()
+
+    def _start_background_refresh(self):
+        if not self._refresh_lock.acquire(False):
+            # A refresh is already running
+            return
+        thread = threading.Thread(target=self._background_refresh)
+        thread.daemon = True
+        self._refresh_thread = thread
+        try:
+            thread.start()
+        except Exception:
+            self._refresh_lock.release()
+            raise
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception:
+            # Keep serving the stale data and back off before retrying
+            self._last_failure = pd.Timestamp.utcnow()
+            self.stats['refresh_errors'] += 1
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self):
+        """
+        Downloads the markets and summaries concurrently and
+        swaps in the joined frame and the market id index.
+        Callers must hold self._refresh_lock.
+        """
+        start = time.time()
+        summaries = {}
+
+        def fetch_summaries():
+            try:
+                summaries['result'] = self.fetch_summaries()
+            except Exception as e:
+                summaries['error'] = e
+
+        thread = threading.Thread(target=fetch_summaries)
+        thread.daemon = True
+        thread.start()
+        markets = self.fetch_markets()
+        thread.join()
+        if 'error' in summaries:
+            raise summaries['error']
+        data = markets.join(summaries['result'], how='outer')
+        market_ids = build_market_index(data)
+
+        self._data = data
+        self._market_ids = market_ids
+        self._last_refresh = pd.Timestamp.utcnow()
+        self._last_failure = None
+        elapsed = time.time() - start
+        self.stats['refreshes'] += 1
+        self.stats['last_refresh_seconds'] = elapsed
+        self.stats['total_refresh_seconds'] += elapsed
+
     def get_order_book(self, quote_currency='HODL', base_currency='BTC', market_id=None):
         if market_id is None:
             if quote_currency is None:
@@ -43,8 +139,7 @@ class CoinExchange(object):
             market_id = self.lookup_market_id(quote_currency, base_currency)
         orders = self._fetch_book_orders(market_id)
         book = LimitOrderBook()
-        for order in orders:
-            book.process_order(order)
+        book.process_orders(orders)
         return book
 
     def fetch_markets(self):
@@ -62,23 +157,20 @@ class CoinExchange(object):
         return frame.astype(np.float)
 
     def _fetch_book_orders(self, market_id):
+        """
+        :param market_id: coinexchange market id
+        :return: dict
+            columns of orders sorted by order time, see parse_book_orders
+        """
         url = self._book_url.format(market_id)
         result = pd.read_json(url).result
-        orders = result.loc['BuyOrders']
-        orders.extend(result.loc['SellOrders'])
-        for i, order in enumerate(orders):
-            order[ORDER_ID] = i
-            # Not actually sure if these are utc but meh for now
-            order[TIMESTAMP] = pd.Timestamp(order.pop('OrderTime'), tz='utc')
-            order[PRICE] = float(order.pop('Price'))
-            order[SIZE] = float(order.pop('Quantity'))
-            order[SIDE] = ORDER_SIDES[order.pop('Type')]
-        return sorted(orders, key=lambda order: order[TIMESTAMP])
+        return parse_book_orders(result.loc['BuyOrders'], result.loc['SellOrders'])
 
     def lookup_market_id(self, quote_currency, base_currency='BTC'):
-        mask = self.markets['MarketAssetCode'] == quote_currency.upper()
-        mask &= self.markets['BaseCurrencyCode'] == base_currency.upper()
-        result = mask.index[mask]
+        # Touching the markets keeps the index fresh
+        self.markets
+        key = (quote_currency.upper(), base_currency.upper())
+        result = self._market_ids.get(key, ())
         hits = len(result)
         if hits > 1:
             raise ValueError('Multiple pairs for {}/{}'.format(quote_currency, base_currency))
@@ -87,3 +179,49 @@ class CoinExchange(object):
         return result[0]
 
 
+def build_market_index(markets):
+    """
+    :param markets: DataFrame indexed by market id
+    :return: dict
+        (asset_code, base_code) -> tuple of market ids
+    """
+    index = {}
+    pairs = zip(
+        markets['MarketAssetCode'].values,
+        markets['BaseCurrencyCode'].values,
+        markets.index
+    )
+    for asset_code, base_code, market_id in pairs:
+        key = (asset_code, base_code)
+        index[key] = index.get(key, ()) + (market_id,)
+    return index
+
+
+def parse_book_orders(buy_orders, sell_orders):
+    """
+    Parses the raw coinexchange orders into typed columns.
+
+    Order ids are the positions of the orders in the raw response
+    (buys first) and the columns are stably sorted by order time.
+
+    :param buy_orders: list of raw order mappings
+    :param sell_orders: list of raw order mappings
+    :return: dict
+        arrays keyed by ORDER_ID, PRICE, SIZE and SIDE,
+        TIMESTAMP is a utc DatetimeIndex so the orders still get
+        tz aware Timestamps.
+    """
+    raw = pd.DataFrame(
+        list(buy_orders) + list(sell_orders),
+        columns=['OrderTime', 'Price', 'Quantity', 'Type']
+    )
+    # Not actually sure if these are utc but meh for now
+    times = pd.DatetimeIndex(pd.to_datetime(raw['OrderTime'], utc=True))
+    order = np.argsort(times.asi8, kind='mergesort')
+    return {
+        ORDER_ID: order,
+        TIMESTAMP: times[order],
+        PRICE: raw['Price'].values.astype(np.float64)[order],
+        SIZE: raw['Quantity'].values.astype(np.float64)[order],
+        SIDE: np.asarray(raw['Type'].map(ORDER_SIDES), dtype=object)[order],
+    }
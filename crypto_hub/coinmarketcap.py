@@ -1,4 +1,6 @@
-import pandas as pd
+from crypto_hub.lazy import lazy_import
+
+pd = lazy_import('pandas')
 
 
 def get_coinmarketcap_data():
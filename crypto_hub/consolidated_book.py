@@ -0,0 +1,192 @@
+import heapq
+
+from crypto_hub.constants import BID, ASK
+
+
+class _SideHeap(object):
+    """
+    Aggregated price levels for one side across venues.
+
+    Prices live in a heap with lazy deletion: emptied levels stay
+    in the heap until they surface at the top, so updates are
+    O(log n) and the best price is amortized O(1).
+    Bid prices are stored negated to get a max heap.
+    """
+
+    def __init__(self, side):
+        self._sign = -1 if side == BID else 1
+        self._heap = []
+        # price -> {venue: size}
+        self.levels = {}
+
+    def update(self, venue, price, size):
+        level = self.levels.get(price)
+        if size > 0:
+            if level is None:
+                level = self.levels[price] = {}
+                heapq.heappush(self._heap, self._sign * price)
+            level[venue] = size
+        elif level is not None:
+            level.pop(venue, None)
+            if not level:
+                del self.levels[price]
+                if len(self._heap) > 2 * len(self.levels) + 64:
+                    self._compact()
+
+    def _compact(self):
+        self._heap = [self._sign * price for price in self.levels]
+        heapq.heapify(self._heap)
+
+    def best(self):
+        heap = self._heap
+        while heap:
+            price = self._sign * heap[0]
+            if price in self.levels:
+                return price
+            heapq.heappop(heap)
+        return None
+
+    def top(self, n):
+        prices = heapq.nsmallest(n, (self._sign * price for price in self.levels))
+        return [self._sign * price for price in prices]
+
+
+class ConsolidatedBook(object):
+    """
+    Merged view of several order books (GDAXOrderBook, LimitOrderBook).
+
+    The consolidated book registers itself as a listener on every book
+    it's given and keeps the aggregated depth per price up to date from
+    their level updates. Prices and sizes are stored as floats so books
+    with Decimal and float prices can be merged.
+
+    Override on_quote to publish changes to the best bid/offer.
+    """
+
+    def __init__(self, books=None):
+        self._sides = {BID: _SideHeap(BID), ASK: _SideHeap(ASK)}
+        self._venues = {}
+        self._venue_by_book = {}
+        # venue -> {side: set of prices}, used to drop a venue on resets
+        self._venue_prices = {}
+        self._best = {BID: None, ASK: None}
+        for venue, book in (books or {}).items():
+            self.add_book(book, venue=venue)
+
+    @property
+    def venues(self):
+        return list(self._venues)
+
+    def add_book(self, book, venue=None):
+        """
+        :param book: GDAXOrderBook or LimitOrderBook
+        :param venue: hashable name, defaults to the book's product_id or id()
+        :return: the venue name
+        """
+        if venue is None:
+            venue = getattr(book, 'product_id', None) or id(book)
+        if venue in self._venues:
+            raise ValueError('Venue {} already added'.format(venue))
+        self._venues[venue] = book
+        self._venue_by_book[id(book)] = venue
+        self._venue_prices[venue] = {BID: set(), ASK: set()}
+        book.add_listener(self)
+        return venue
+
+    def remove_book(self, venue):
+        book = self._venues.pop(venue)
+        del self._venue_by_book[id(book)]
+        book.remove_listener(self)
+        self._clear_venue(venue)
+        del self._venue_prices[venue]
+
+    def on_level_update(self, book, side, price, size):
+        venue = self._venue_by_book[id(book)]
+        # Rounded so tick multiples from LimitOrderBook (e.g. 1007 * 0.01)
+        # land on the same key as the decimal prices from GDAX
+        price = round(float(price), 10)
+        size = float(size)
+        self._sides[side].update(venue, price, size)
+        prices = self._venue_prices[venue][side]
+        if size > 0:
+            prices.add(price)
+        else:
+            prices.discard(price)
+        self._check_best(side)
+
+    def on_trade(self, book, side, price, size):
+        pass
+
+    def on_book_reset(self, book):
+        self._clear_venue(self._venue_by_book[id(book)])
+
+    def _clear_venue(self, venue):
+        for side, prices in self._venue_prices[venue].items():
+            heap = self._sides[side]
+            for price in prices:
+                heap.update(venue, price, 0)
+            prices.clear()
+            self._check_best(side)
+
+    def _check_best(self, side):
+        price = self._sides[side].best()
+        quote = None if price is None else (price, self.size_at(side, price))
+        if quote != self._best[side]:
+            self._best[side] = quote
+            self.on_quote(side, quote)
+
+    def on_quote(self, side, quote):
+        """
+        Override this to send best bid/offer updates out.
+
+        :param side: BID or ASK
+        :param quote: (price, total size) or None if the side is empty
+        """
+        pass
+
+    def best_bid(self):
+        """
+        :return: (price, total size) or None
+        """
+        return self._best[BID]
+
+    def best_ask(self):
+        """
+        :return: (price, total size) or None
+        """
+        return self._best[ASK]
+
+    def nbbo(self):
+        """
+        :return: dict
+            best bid/ask prices and sizes with the venues quoting them.
+        """
+        result = {}
+        for side in (BID, ASK):
+            quote = self._best[side]
+            if quote is None:
+                result[side] = None
+                continue
+            price, size = quote
+            result[side] = {
+                'price': price,
+                'size': size,
+                'venues': dict(self._sides[side].levels[price]),
+            }
+        return result
+
+    def size_at(self, side, price):
+        level = self._sides[side].levels.get(round(float(price), 10))
+        return sum(level.values()) if level else 0.0
+
+    def depth(self, side, levels=10):
+        """
+        :param side: BID or ASK
+        :param levels: number of price levels from the top
+        :return: list of (price, total size, {venue: size}) best first
+        """
+        heap = self._sides[side]
+        return [
+            (price, sum(heap.levels[price].values()), dict(heap.levels[price]))
+            for price in heap.top(levels)
+        ]
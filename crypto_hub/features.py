@@ -0,0 +1,273 @@
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+from crypto_hub.constants import BID, ASK
+from crypto_hub.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+
+class _SortedSide(object):
+    """
+    Price levels for one side kept in an ascending list for range queries.
+    """
+
+    def __init__(self):
+        self.prices = []
+        self.sizes = {}
+
+    def update(self, price, size):
+        """
+        :return: the previous size at the price
+        """
+        old = self.sizes.get(price, 0.0)
+        if size > 0:
+            if price not in self.sizes:
+                insort(self.prices, price)
+            self.sizes[price] = size
+        elif price in self.sizes:
+            del self.sizes[price]
+            del self.prices[bisect_left(self.prices, price)]
+        return old
+
+    def clear(self):
+        self.prices = []
+        self.sizes = {}
+
+
+class FeatureEngine(object):
+    """
+    Streaming order book features for a single product.
+
+    Registers as a listener on a GDAXOrderBook or LimitOrderBook and
+    updates the features from level updates and trades instead of
+    rescanning the book. Depth band sums are adjusted by the size change
+    of an update, and when the mid moves only the levels crossing the
+    old and new band limits are added or taken out.
+
+    After every update a row is written to a fixed size ring buffer,
+    columns are listed in self.columns:
+
+        time, best_bid, best_ask, bid_size, ask_size, mid, spread,
+        microprice, imbalance,
+        bid_depth_{n}bps, ask_depth_{n}bps, bid_vwap_{n}bps, ask_vwap_{n}bps
+            size resting within n bps of the mid and its average price,
+        trade_vwap, trade_volume
+            over the last trade_window seconds.
+    """
+
+    def __init__(self, book=None, capacity=1024, depth_bps=(10, 50), trade_window=60.0):
+        self.depth_bps = tuple(depth_bps)
+        self.trade_window = trade_window
+        self.columns = [
+            'time', 'best_bid', 'best_ask', 'bid_size', 'ask_size',
+            'mid', 'spread', 'microprice', 'imbalance',
+        ]
+        for n in self.depth_bps:
+            self.columns.extend([
+                'bid_depth_{}bps'.format(n), 'ask_depth_{}bps'.format(n),
+                'bid_vwap_{}bps'.format(n), 'ask_vwap_{}bps'.format(n),
+            ])
+        self.columns.extend(['trade_vwap', 'trade_volume'])
+        self.capacity = capacity
+        self._buffer = np.full((capacity, len(self.columns)), np.nan)
+        self._count = 0
+
+        self._sides = {BID: _SortedSide(), ASK: _SortedSide()}
+        self._mid = None
+        # side -> band price limits per depth_bps for the current mid
+        self._limits = {BID: [], ASK: []}
+        # side -> [size within band, notional within band] per depth_bps
+        self._bands = {BID: [[0.0, 0.0] for _ in self.depth_bps],
+                       ASK: [[0.0, 0.0] for _ in self.depth_bps]}
+        self._trades = deque()
+        self._trade_volume = 0.0
+        self._trade_notional = 0.0
+
+        self.product_id = None
+        self._book = None
+        if book is not None:
+            self.attach(book)
+
+    def attach(self, book):
+        self._book = book
+        self.product_id = getattr(book, 'product_id', None)
+        book.add_listener(self)
+
+    def detach(self):
+        if self._book is not None:
+            self._book.remove_listener(self)
+            self._book = None
+
+    def on_book_reset(self, book):
+        for side in self._sides.values():
+            side.clear()
+        self._mid = None
+        for bands in self._bands.values():
+            for band in bands:
+                band[0] = band[1] = 0.0
+
+    def on_level_update(self, book, side, price, size):
+        price = float(price)
+        size = float(size)
+        old = self._sides[side].update(price, size)
+        if self._mid is not None:
+            # Sums for the current limits first, then move the limits
+            delta = size - old
+            is_bid = side == BID
+            for band, limit in zip(self._bands[side], self._limits[side]):
+                if (price >= limit) if is_bid else (price <= limit):
+                    band[0] += delta
+                    band[1] += delta * price
+        mid = self._compute_mid()
+        if mid != self._mid:
+            if mid is None or self._mid is None:
+                self._mid = mid
+                self._resum_bands()
+            else:
+                self._mid = mid
+                self._move_bands()
+        self._record()
+
+    def on_trade(self, book, side, price, size):
+        now = time.time()
+        price = float(price)
+        size = float(size)
+        self._trades.append((now, price, size))
+        self._trade_volume += size
+        self._trade_notional += price * size
+        self._expire_trades(now)
+        self._record(now)
+
+    def _expire_trades(self, now):
+        cutoff = now - self.trade_window
+        trades = self._trades
+        while trades and trades[0][0] < cutoff:
+            _, price, size = trades.popleft()
+            self._trade_volume -= size
+            self._trade_notional -= price * size
+        if not trades:
+            # Drop accumulated rounding error
+            self._trade_volume = self._trade_notional = 0.0
+
+    def _compute_mid(self):
+        bids = self._sides[BID].prices
+        asks = self._sides[ASK].prices
+        if not bids or not asks:
+            return None
+        return (bids[-1] + asks[0]) / 2.0
+
+    def _resum_bands(self):
+        mid = self._mid
+        for side, bands in self._bands.items():
+            if mid is None:
+                self._limits[side] = []
+                for band in bands:
+                    band[0] = band[1] = 0.0
+                continue
+            sign = -1 if side == BID else 1
+            self._limits[side] = [mid * (1 + sign * n / 1e4) for n in self.depth_bps]
+            book_side = self._sides[side]
+            prices = book_side.prices
+            sizes = book_side.sizes
+            for band, limit in zip(bands, self._limits[side]):
+                if side == BID:
+                    in_band = prices[bisect_left(prices, limit):]
+                else:
+                    in_band = prices[:bisect_right(prices, limit)]
+                band[0] = sum(sizes[p] for p in in_band)
+                band[1] = sum(p * sizes[p] for p in in_band)
+
+    def _move_bands(self):
+        """
+        Shifts the band limits to the current mid, only the levels between
+        the old and new limit of a band change its sums.
+        """
+        mid = self._mid
+        for side, bands in self._bands.items():
+            sign = -1 if side == BID else 1
+            old_limits = self._limits[side]
+            new_limits = [mid * (1 + sign * n / 1e4) for n in self.depth_bps]
+            self._limits[side] = new_limits
+            book_side = self._sides[side]
+            prices = book_side.prices
+            sizes = book_side.sizes
+            # Bids are in the band from the limit up, asks up to the limit
+            find = bisect_left if side == BID else bisect_right
+            for band, old_limit, new_limit in zip(bands, old_limits, new_limits):
+                if new_limit == old_limit:
+                    continue
+                lo = find(prices, min(old_limit, new_limit))
+                hi = find(prices, max(old_limit, new_limit))
+                if lo == hi:
+                    continue
+                # Bid bands grow when the limit drops, ask bands when it rises
+                grows = (new_limit < old_limit) if side == BID else (new_limit > old_limit)
+                size_sum = notional = 0.0
+                for i in range(lo, hi):
+                    p = prices[i]
+                    size_sum += sizes[p]
+                    notional += p * sizes[p]
+                if grows:
+                    band[0] += size_sum
+                    band[1] += notional
+                else:
+                    band[0] -= size_sum
+                    band[1] -= notional
+
+    def _record(self, now=None):
+        if now is None:
+            now = time.time()
+            self._expire_trades(now)
+        nan = float('nan')
+        bids = self._sides[BID]
+        asks = self._sides[ASK]
+        best_bid = bids.prices[-1] if bids.prices else nan
+        best_ask = asks.prices[0] if asks.prices else nan
+        bid_size = bids.sizes[best_bid] if bids.prices else 0.0
+        ask_size = asks.sizes[best_ask] if asks.prices else 0.0
+        top_size = bid_size + ask_size
+        if self._mid is None or top_size <= 0:
+            mid = spread = microprice = imbalance = nan
+        else:
+            mid = self._mid
+            spread = best_ask - best_bid
+            microprice = (best_bid * ask_size + best_ask * bid_size) / top_size
+            imbalance = (bid_size - ask_size) / top_size
+        row = [now, best_bid, best_ask, bid_size, ask_size, mid, spread, microprice, imbalance]
+        for bid_band, ask_band in zip(self._bands[BID], self._bands[ASK]):
+            row.extend([
+                bid_band[0],
+                ask_band[0],
+                bid_band[1] / bid_band[0] if bid_band[0] > 0 else nan,
+                ask_band[1] / ask_band[0] if ask_band[0] > 0 else nan,
+            ])
+        if self._trade_volume > 0:
+            row.extend([self._trade_notional / self._trade_volume, self._trade_volume])
+        else:
+            row.extend([nan, 0.0])
+        self._buffer[self._count % self.capacity] = row
+        self._count += 1
+
+    def latest(self):
+        """
+        :return: np.ndarray
+            copy of the most recent feature vector (all nan before any update)
+        """
+        if not self._count:
+            return np.full(len(self.columns), np.nan)
+        return self._buffer[(self._count - 1) % self.capacity].copy()
+
+    def latest_dict(self):
+        return dict(zip(self.columns, self.latest().tolist()))
+
+    def history(self):
+        """
+        :return: np.ndarray
+            rows in the ring buffer, oldest first
+        """
+        if self._count <= self.capacity:
+            return self._buffer[:self._count].copy()
+        start = self._count % self.capacity
+        return np.concatenate([self._buffer[start:], self._buffer[:start]])
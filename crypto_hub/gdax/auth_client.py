@@ -1,9 +1,11 @@
 
 import os
-import numpy as np
-import pandas as pd
 
 from gdax.authenticated_client import AuthenticatedClient
+from crypto_hub.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 class GDAXAuthClient(AuthenticatedClient):
@@ -1,39 +1,116 @@
 import pickle
 from decimal import Decimal
 
-from bintrees import RBTree
-from crypto_hub.gdax.public_client import PublicGDAXClient
+from crypto_hub.constants import BID, ASK
+from crypto_hub.lazy import lazy_import
+from crypto_hub.checkpoint import write_checkpoint, read_checkpoint
+from crypto_hub.gdax.instrumentation import instrument_book
+
+np = lazy_import('numpy')
+bintrees = lazy_import('bintrees')
 
 
 class GDAXOrderBook(object):
 
-    def __init__(self, product_id='BTC-USD', log_to=None, public_client=None):
+    def __init__(self, product_id='BTC-USD', log_to=None, public_client=None, metrics=None):
 
         self._product_id = product_id
-        self._asks = RBTree()
-        self._bids = RBTree()
+        self._asks = bintrees.RBTree()
+        self._bids = bintrees.RBTree()
         if public_client is None:
+            # Deferred, this pulls in the gdax package
+            from crypto_hub.gdax.public_client import PublicGDAXClient
             public_client = PublicGDAXClient()
         self._client = public_client
         self._sequence = -1
+        # Set by load_checkpoint so on_open keeps the restored sequence
+        self._restored = False
         self._log_to = log_to
         if self._log_to:
             assert hasattr(self._log_to, 'write')
         self._current_ticker = None
+        self._listeners = []
+        # Total size per price level, only kept while there are listeners
+        self._level_sizes = {BID: {}, ASK: {}}
+        self._metrics = metrics
+        if metrics is not None:
+            instrument_book(self, metrics)
 
     @property
     def product_id(self):
         return self._product_id
 
+    def add_listener(self, listener):
+        """
+        Registers a listener for level updates.
+
+        listener.on_level_update(book, side, price, size) is called with
+        the new total size whenever a price level changes (0 when removed),
+        listener.on_trade(book, side, price, size) for every match (side of
+        the maker order) and listener.on_book_reset(book) before the book
+        is reloaded.
+
+        The listener is sent the levels already in the book when it's added.
+
+        :param listener: object implementing on_level_update, on_trade and on_book_reset
+        """
+        if not self._listeners:
+            self._compute_level_sizes()
+        self._listeners.append(listener)
+        self._send_levels(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+        if not self._listeners:
+            self._level_sizes = {BID: {}, ASK: {}}
+
+    def _compute_level_sizes(self):
+        for side, tree in ((BID, self._bids), (ASK, self._asks)):
+            self._level_sizes[side] = {
+                price: sum(order['size'] for order in orders)
+                for price, orders in tree.items()
+                if orders
+            }
+
+    def _send_levels(self, listener):
+        for side in (BID, ASK):
+            for price, size in list(self._level_sizes[side].items()):
+                listener.on_level_update(self, side, price, size)
+
+    def _level_changed(self, side, price, delta):
+        """
+        Updates the level total and notifies the listeners.
+
+        :param side: 'buy' or 'sell'
+        :param delta: change in the size resting at the price
+        """
+        if not delta:
+            return
+        side = BID if side == 'buy' else ASK
+        sizes = self._level_sizes[side]
+        size = sizes.get(price, 0) + delta
+        if size > 0:
+            sizes[price] = size
+        else:
+            sizes.pop(price, None)
+            size = 0
+        for listener in self._listeners:
+            listener.on_level_update(self, side, price, size)
+
     def on_open(self):
-        self._sequence = -1
+        if not self._restored:
+            self._sequence = -1
 
     def on_close(self):
         pass
 
     def reset_book(self):
-        self._asks = RBTree()
-        self._bids = RBTree()
+        for listener in self._listeners:
+            listener.on_book_reset(self)
+        self._level_sizes = {BID: {}, ASK: {}}
+        self._restored = False
+        self._asks = bintrees.RBTree()
+        self._bids = bintrees.RBTree()
         res = self._client.get_product_order_book(product_id=self.product_id, level=3)
         for bid in res['bids']:
             self.add({
@@ -53,7 +130,7 @@ class GDAXOrderBook(object):
 
     def on_message(self, message):
         if self._log_to:
-            pickle.dump(message, self._log_to)
+            self.log_message(message)
 
         sequence = message['sequence']
         if self._sequence == -1:
@@ -79,6 +156,108 @@ class GDAXOrderBook(object):
 
         self._sequence = sequence
 
+    def log_message(self, message):
+        pickle.dump(message, self._log_to)
+
+    def replay(self, messages):
+        """
+        Applies messages (e.g. read with iter_message_log) without logging them.
+        Rebuilds a book offline from a checkpoint and a log recorded with log_to.
+        """
+        log_to, self._log_to = self._log_to, None
+        try:
+            for message in messages:
+                if message.get('product_id', self.product_id) == self.product_id:
+                    self.on_message(message)
+        finally:
+            self._log_to = log_to
+
+    def save_checkpoint(self, path):
+        """
+        Writes the book to a columnar binary file.
+
+        Prices and sizes are stored as integers scaled by the largest
+        number of decimal places in the book so Decimals round trip exactly.
+
+        :param path: checkpoint file, see crypto_hub.checkpoint
+        """
+        prices, sizes, ids, sides = [], [], [], []
+        for side_flag, tree in enumerate((self._bids, self._asks)):
+            for price, orders in tree.items():
+                for order in orders:
+                    prices.append(order['price'])
+                    sizes.append(order['size'])
+                    ids.append(order['id'])
+                    sides.append(side_flag)
+        price_places = _decimal_places(prices)
+        size_places = _decimal_places(sizes)
+        write_checkpoint(path, [
+            ('price', _scaled_ints(prices, price_places)),
+            ('size', _scaled_ints(sizes, size_places)),
+            ('id', np.array([i.encode('ascii') for i in ids], dtype=np.bytes_)),
+            ('side', np.array(sides, dtype=np.uint8)),
+        ], meta={
+            'kind': 'GDAXOrderBook',
+            'product_id': self.product_id,
+            'sequence': self._sequence,
+            'price_places': price_places,
+            'size_places': size_places,
+            'best_bid': str(self._bids.max_key()) if self._bids else None,
+            'best_ask': str(self._asks.min_key()) if self._asks else None,
+        })
+
+    def load_checkpoint(self, path, mmap=True):
+        """
+        Restores the book from save_checkpoint instead of a REST snapshot.
+
+        The book continues from the checkpoint sequence, so replay can
+        apply messages recorded after it. GDAX doesn't resend missed
+        messages, on a live feed the first message after a restart is
+        a gap and the book still resyncs from a REST snapshot.
+
+        :param path: checkpoint file
+        :param mmap: memory map the file instead of reading it
+        :return: int
+            the checkpoint sequence
+        """
+        columns, meta = read_checkpoint(path, mmap=mmap)
+        if meta.get('kind') != 'GDAXOrderBook' or meta['product_id'] != self.product_id:
+            raise ValueError('{} is not a {} checkpoint'.format(path, self.product_id))
+        for listener in self._listeners:
+            listener.on_book_reset(self)
+        price_exp = -meta['price_places']
+        size_exp = -meta['size_places']
+        trees = (bintrees.RBTree(), bintrees.RBTree())
+        last_key = None
+        orders = None
+        rows = zip(
+            columns['price'].tolist(),
+            columns['size'].tolist(),
+            columns['id'].tolist(),
+            columns['side'].tolist(),
+        )
+        for price, size, order_id, side_flag in rows:
+            # Rows are grouped by side and price so each level is built once
+            if (side_flag, price) != last_key:
+                last_key = (side_flag, price)
+                price_dec = Decimal(price).scaleb(price_exp)
+                orders = []
+                trees[side_flag].insert(price_dec, orders)
+            orders.append({
+                'id': order_id.decode('ascii'),
+                'side': 'sell' if side_flag else 'buy',
+                'price': price_dec,
+                'size': Decimal(size).scaleb(size_exp),
+            })
+        self._bids, self._asks = trees
+        self._sequence = meta['sequence']
+        self._restored = True
+        if self._listeners:
+            self._compute_level_sizes()
+            for listener in self._listeners:
+                self._send_levels(listener)
+        return self._sequence
+
     def on_sequence_gap(self, gap_start, gap_end):
         self.reset_book()
         print('Error: messages missing ({} - {}). Re-initializing  book at sequence.'.format(
@@ -105,9 +284,15 @@ class GDAXOrderBook(object):
             else:
                 asks.append(order)
             self.set_asks(order['price'], asks)
+        if self._listeners:
+            self._level_changed(order['side'], order['price'], order['size'])
 
     def remove(self, order):
         price = Decimal(order['price'])
+        if self._listeners:
+            orders = (self.get_bids(price) if order['side'] == 'buy' else self.get_asks(price)) or []
+            removed = sum(o['size'] for o in orders if o['id'] == order['order_id'])
+            self._level_changed(order['side'], price, -removed)
         if order['side'] == 'buy':
             bids = self.get_bids(price)
             if bids is not None:
@@ -128,12 +313,18 @@ class GDAXOrderBook(object):
     def match(self, order):
         size = Decimal(order['size'])
         price = Decimal(order['price'])
+        if self._listeners:
+            side = BID if order['side'] == 'buy' else ASK
+            for listener in self._listeners:
+                listener.on_trade(self, side, price, size)
 
         if order['side'] == 'buy':
             bids = self.get_bids(price)
             if not bids:
                 return
             assert bids[0]['id'] == order['maker_order_id']
+            if self._listeners:
+                self._level_changed('buy', price, -size)
             if bids[0]['size'] == size:
                 self.set_bids(price, bids[1:])
             else:
@@ -144,6 +335,8 @@ class GDAXOrderBook(object):
             if not asks:
                 return
             assert asks[0]['id'] == order['maker_order_id']
+            if self._listeners:
+                self._level_changed('sell', price, -size)
             if asks[0]['size'] == size:
                 self.set_asks(price, asks[1:])
             else:
@@ -166,6 +359,8 @@ class GDAXOrderBook(object):
             if bids is None or not any(o['id'] == order['order_id'] for o in bids):
                 return
             index = [b['id'] for b in bids].index(order['order_id'])
+            if self._listeners:
+                self._level_changed('buy', price, new_size - bids[index]['size'])
             bids[index]['size'] = new_size
             self.set_bids(price, bids)
         else:
@@ -173,6 +368,8 @@ class GDAXOrderBook(object):
             if asks is None or not any(o['id'] == order['order_id'] for o in asks):
                 return
             index = [a['id'] for a in asks].index(order['order_id'])
+            if self._listeners:
+                self._level_changed('sell', price, new_size - asks[index]['size'])
             asks[index]['size'] = new_size
             self.set_asks(price, asks)
 
@@ -234,4 +431,29 @@ class GDAXOrderBook(object):
         self._bids.remove(price)
 
     def set_bids(self, price, bids):
-        self._bids.insert(price, bids)
\ No newline at end of file
+        self._bids.insert(price, bids)
+
+
+def iter_message_log(f):
+    """
+    Yields the messages pickled to a GDAXOrderBook log_to file.
+    Stops at a truncated last message, e.g. after a crash.
+    """
+    while True:
+        try:
+            yield pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            return
+
+
+def _decimal_places(values):
+    places = 0
+    for value in values:
+        exponent = value.as_tuple().exponent
+        if -exponent > places:
+            places = -exponent
+    return places
+
+
+def _scaled_ints(values, places):
+    return np.array([int(value.scaleb(places)) for value in values], dtype=np.int64)
@@ -1,9 +1,10 @@
-import pandas as pd
-
 from crypto_hub.constants import GDAX_PAIRS
+from crypto_hub.lazy import lazy_import
 from crypto_hub.gdax.auth_client import GDAXAuthClient
 from crypto_hub.gdax.socket_client import GDAXSocketClient
 
+pd = lazy_import('pandas')
+
 
 class GDAXClient(object):
     """
@@ -0,0 +1,211 @@
+import time
+import calendar
+from functools import wraps
+
+from crypto_hub.metrics import clock
+
+# Resyncs download the whole level 3 book so they need longer buckets.
+RESYNC_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 60.0)
+
+# add/remove/match/change are timed around on_message, see HANDLER_BY_TYPE
+BOOK_HANDLERS = ('log_message',)
+
+# Message type -> GDAXOrderBook handler it's dispatched to
+HANDLER_BY_TYPE = {'open': 'add', 'done': 'remove', 'match': 'match', 'change': 'change'}
+
+# Consecutive messages mostly share the whole second, only its epoch is
+# cached. Rebound as a whole so other threads never see a torn pair.
+_last_second = (None, 0)
+
+
+def parse_exchange_time(timestamp):
+    """
+    :param timestamp: str
+        GDAX message time, e.g. '2017-11-01T12:00:00.123456Z'
+    :return: float
+        seconds since the epoch
+    """
+    global _last_second
+    prefix = timestamp[:19]
+    cached_prefix, seconds = _last_second
+    if prefix != cached_prefix:
+        if len(prefix) != 19 or prefix[10] != 'T':
+            raise ValueError('Bad exchange time {!r}'.format(timestamp))
+        seconds = calendar.timegm((
+            int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]),
+            int(prefix[11:13]), int(prefix[14:16]), int(prefix[17:19]),
+        ))
+        _last_second = (prefix, seconds)
+    # '.123456' parses as is
+    fraction = timestamp[19:].rstrip('Z')
+    if fraction:
+        return seconds + float(fraction)
+    return seconds
+
+
+def _timed(func, histogram):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(clock() - start)
+    return wrapper
+
+
+def instrument_book(book, metrics, sample_every=32):
+    """
+    Wraps the message handlers of a GDAXOrderBook instance.
+
+    Records per product:
+        gdax_book_messages_total{type}      messages received
+        gdax_book_message_seconds{type}     time spent in on_message
+        gdax_book_handler_seconds{handler}  add/remove/match/change, the
+                                            on_message time of the types
+                                            they handle, and log_message
+        gdax_feed_lag_seconds               local time - exchange time
+        gdax_sequence_gaps_total            gaps detected
+        gdax_sequence_gap_messages_total    messages missed in gaps
+        gdax_resyncs_total                  level 3 snapshots loaded
+        gdax_resync_seconds                 snapshot download + load time
+
+    Every message is counted but only every sample_every-th message of
+    each type is timed and has its lag measured, reading the clocks and
+    parsing the exchange time costs about as much as applying a message
+    to the book.
+
+    Books that are never instrumented pay nothing.
+
+    :param book: GDAXOrderBook
+    :param metrics: crypto_hub.metrics.MetricsRegistry
+    :param sample_every: int, 1 times every message
+    :return: the book
+    """
+    product = (('product', book.product_id),)
+
+    for name in BOOK_HANDLERS:
+        histogram = metrics.histogram(
+            'gdax_book_handler_seconds', product + (('handler', name),))
+        setattr(book, name, _timed(getattr(book, name), histogram))
+
+    book.reset_book = _timed(book.reset_book, metrics.histogram(
+        'gdax_resync_seconds', product, bounds=RESYNC_BUCKETS))
+    resyncs = metrics.counter('gdax_resyncs_total', product)
+    reset_book = book.reset_book
+
+    @wraps(reset_book)
+    def counted_reset_book(*args, **kwargs):
+        resyncs.inc()
+        return reset_book(*args, **kwargs)
+    book.reset_book = counted_reset_book
+
+    gaps = metrics.counter('gdax_sequence_gaps_total', product)
+    gap_messages = metrics.counter('gdax_sequence_gap_messages_total', product)
+    on_sequence_gap = book.on_sequence_gap
+
+    @wraps(on_sequence_gap)
+    def counted_sequence_gap(gap_start, gap_end):
+        gaps.inc()
+        gap_messages.inc(gap_end - gap_start - 1)
+        return on_sequence_gap(gap_start, gap_end)
+    book.on_sequence_gap = counted_sequence_gap
+
+    lag = metrics.histogram('gdax_feed_lag_seconds', product, bounds=LAG_BUCKETS)
+    counters = {}
+    histograms = {}
+    on_message = book.on_message
+
+    def type_histograms(msg_type):
+        result = [metrics.histogram('gdax_book_message_seconds', product + (('type', msg_type),))]
+        handler = HANDLER_BY_TYPE.get(msg_type)
+        if handler is not None:
+            result.append(metrics.histogram(
+                'gdax_book_handler_seconds', product + (('handler', handler),)))
+        histograms[msg_type] = result
+        return result
+
+    @wraps(on_message)
+    def timed_on_message(message):
+        # Runs for every message, keep it to a dict lookup and an add
+        msg_type = message['type']
+        counter = counters.get(msg_type)
+        if counter is None:
+            counter = counters[msg_type] = metrics.counter(
+                'gdax_book_messages_total', product + (('type', msg_type),))
+        counter.value = count = counter.value + 1
+        if count % sample_every:
+            return on_message(message)
+        start = clock()
+        try:
+            return on_message(message)
+        finally:
+            elapsed = clock() - start
+            for histogram in histograms.get(msg_type) or type_histograms(msg_type):
+                histogram.observe(elapsed)
+            exchange_time = message.get('time')
+            if exchange_time:
+                try:
+                    lag.observe(time.time() - parse_exchange_time(exchange_time))
+                except ValueError:
+                    pass
+    book.on_message = timed_on_message
+    return book
+
+
+def instrument_socket_client(client, metrics, sample_every=32):
+    """
+    Wraps GDAXSocketClient.on_message.
+
+    Records:
+        gdax_socket_messages_total              messages received, the books
+                                                count them per product and type
+        gdax_socket_message_seconds{product}    time spent in on_message
+                                                (book update and mongo insert)
+        gdax_socket_receive_seconds             time between the end of one
+                                                message and the start of the
+                                                next, i.e. waiting on the
+                                                websocket and decoding json
+
+    The timings are sampled every sample_every messages, see instrument_book.
+
+    :param client: GDAXSocketClient
+    :param metrics: crypto_hub.metrics.MetricsRegistry
+    :param sample_every: int, 1 times every message
+    :return: the client
+    """
+    messages = metrics.counter('gdax_socket_messages_total')
+    histograms = {}
+    receive = metrics.histogram('gdax_socket_receive_seconds')
+    # End of the message before a timed one
+    last_done = [None]
+    on_message = client.on_message
+
+    @wraps(on_message)
+    def timed_on_message(msg):
+        messages.value = count = messages.value + 1
+        phase = count % sample_every
+        if phase:
+            if phase != sample_every - 1:
+                return on_message(msg)
+            # The next message is timed, note when this one ends
+            try:
+                return on_message(msg)
+            finally:
+                last_done[0] = clock()
+        start = clock()
+        if last_done[0] is not None:
+            receive.observe(start - last_done[0])
+        product_id = msg.get('product_id')
+        histogram = histograms.get(product_id)
+        if histogram is None:
+            histogram = histograms[product_id] = metrics.histogram(
+                'gdax_socket_message_seconds', (('product', product_id),))
+        try:
+            return on_message(msg)
+        finally:
+            last_done[0] = clock()
+            histogram.observe(last_done[0] - start)
+    client.on_message = timed_on_message
+    return client
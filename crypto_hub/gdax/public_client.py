@@ -1,7 +1,9 @@
-import numpy as np
-import pandas as pd
 from gdax import PublicClient
 from crypto_hub.constants import SATOSHI
+from crypto_hub.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 class PublicGDAXClient(PublicClient):
@@ -0,0 +1,659 @@
+"""
+Local GDAX exchange simulator.
+
+Serves a websocket feed and the public REST endpoints used by
+PublicGDAXClient (level 3 book, ticker, candles) from a deterministic
+synthetic order flow, so the socket client, book resyncs and the mongo
+path can be exercised without the live exchange:
+
+    with GDAXSimulator(messages_per_second=1000, gap_probability=0.001) as sim:
+        client = GDAXSocketClient(url=sim.ws_url, api_url=sim.api_url)
+        client.start()
+
+or from the command line:
+
+    python -m crypto_hub.gdax.simulator --rate 1000 --gap-probability 0.001
+"""
+import time
+import json
+import uuid
+import base64
+import struct
+import socket
+import random
+import hashlib
+import argparse
+import threading
+from collections import deque
+from datetime import datetime
+
+from six.moves import socketserver, BaseHTTPServer
+from six.moves.urllib.parse import urlparse, parse_qs
+
+from crypto_hub.constants import GDAX_PAIRS
+
+_WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_UNITS = 10 ** 8  # sizes are kept as integer satoshis
+_CANDLE_SIZES = (60, 300, 900, 3600, 21600, 86400)
+
+
+def _format_price(ticks, tick_size):
+    return '{:.2f}'.format(ticks * tick_size)
+
+
+def _format_size(units):
+    return '{}.{:08d}'.format(units // _UNITS, units % _UNITS)
+
+
+def _utc_now():
+    return datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class SyntheticProduct(object):
+    """
+    Level 3 book for one product driven by a seeded random order flow.
+
+    Every generated message is consistent with the book state,
+    e.g. a match always takes the first order at the best price.
+    """
+
+    def __init__(self, product_id, rng, mid_price=100.0, tick_size=0.01,
+                 initial_depth=50, max_orders=2000):
+        self.product_id = product_id
+        self.tick_size = tick_size
+        self.max_orders = max_orders
+        self.sequence = 0
+        self._rng = rng
+        self._mid = int(round(mid_price / tick_size))
+        self._levels = {'buy': {}, 'sell': {}}
+        self._orders = {}
+        # Resting order ids and their positions for uniform random picks
+        self._order_ids = []
+        self._order_index = {}
+        self._pending = deque()
+        self._trade_id = 0
+        self.trades = deque(maxlen=100000)
+        for i in range(initial_depth):
+            self._rest('buy', self._mid - 1 - i, self._random_size())
+            self._rest('sell', self._mid + 1 + i, self._random_size())
+
+    def _new_id(self):
+        return str(uuid.UUID(int=self._rng.getrandbits(128)))
+
+    def _random_size(self):
+        return self._rng.randint(_UNITS // 100, 2 * _UNITS)
+
+    def _rest(self, side, price, size):
+        order = {'id': self._new_id(), 'side': side, 'price': price, 'size': size}
+        self._levels[side].setdefault(price, []).append(order)
+        self._orders[order['id']] = order
+        self._order_index[order['id']] = len(self._order_ids)
+        self._order_ids.append(order['id'])
+        return order
+
+    def _unrest(self, order):
+        level = self._levels[order['side']][order['price']]
+        level.remove(order)
+        if not level:
+            del self._levels[order['side']][order['price']]
+        del self._orders[order['id']]
+        # Swap the last id into the removed slot
+        index = self._order_index.pop(order['id'])
+        last = self._order_ids.pop()
+        if last != order['id']:
+            self._order_ids[index] = last
+            self._order_index[last] = index
+
+    def best(self, side):
+        levels = self._levels[side]
+        if not levels:
+            return None
+        return max(levels) if side == 'buy' else min(levels)
+
+    def _message(self, msg_type, **fields):
+        self.sequence += 1
+        fields.update({
+            'type': msg_type,
+            'product_id': self.product_id,
+            'sequence': self.sequence,
+            'time': _utc_now(),
+        })
+        return fields
+
+    def next_message(self):
+        """
+        :return: dict
+            the next feed message, the book state is already updated.
+        """
+        if self._pending:
+            return self._message(**self._pending.popleft())
+        roll = self._rng.random()
+        if len(self._orders) > self.max_orders:
+            roll = 0.5
+        if roll < 0.45 or not self._orders:
+            return self._open()
+        elif roll < 0.75:
+            return self._cancel()
+        elif roll < 0.9:
+            return self._match()
+        return self._change()
+
+    def _open(self):
+        side = 'buy' if self._rng.random() < 0.5 else 'sell'
+        offset = int(self._rng.expovariate(0.2))
+        if side == 'buy':
+            best_ask = self.best('sell')
+            price = (self._mid if best_ask is None else best_ask) - 1 - offset
+            price = max(price, 1)
+        else:
+            best_bid = self.best('buy')
+            price = (self._mid if best_bid is None else best_bid) + 1 + offset
+        order = self._rest(side, price, self._random_size())
+        return self._message(
+            'open',
+            side=side,
+            order_id=order['id'],
+            price=_format_price(price, self.tick_size),
+            remaining_size=_format_size(order['size']),
+        )
+
+    def _random_order(self):
+        order_ids = self._order_ids
+        return self._orders[order_ids[self._rng.randrange(len(order_ids))]]
+
+    def _cancel(self):
+        order = self._random_order()
+        self._unrest(order)
+        return self._message(
+            'done',
+            side=order['side'],
+            order_id=order['id'],
+            reason='canceled',
+            price=_format_price(order['price'], self.tick_size),
+            remaining_size=_format_size(order['size']),
+        )
+
+    def _match(self):
+        side = 'buy' if self._rng.random() < 0.5 else 'sell'
+        price = self.best(side)
+        if price is None:
+            return self._open()
+        maker = self._levels[side][price][0]
+        size = min(maker['size'], self._random_size())
+        maker['size'] -= size
+        self._trade_id += 1
+        price_str = _format_price(price, self.tick_size)
+        if maker['size'] == 0:
+            self._unrest(maker)
+            self._pending.append({
+                'msg_type': 'done',
+                'side': side,
+                'order_id': maker['id'],
+                'reason': 'filled',
+                'price': price_str,
+                'remaining_size': _format_size(0),
+            })
+        self._mid = price
+        self.trades.append((time.time(), price * self.tick_size, size / float(_UNITS)))
+        return self._message(
+            'match',
+            trade_id=self._trade_id,
+            maker_order_id=maker['id'],
+            taker_order_id=self._new_id(),
+            side=side,
+            size=_format_size(size),
+            price=price_str,
+        )
+
+    def _change(self):
+        order = self._random_order()
+        if order['size'] < 2:
+            return self._cancel()
+        old_size = order['size']
+        order['size'] = self._rng.randint(1, old_size - 1)
+        return self._message(
+            'change',
+            side=order['side'],
+            order_id=order['id'],
+            price=_format_price(order['price'], self.tick_size),
+            old_size=_format_size(old_size),
+            new_size=_format_size(order['size']),
+        )
+
+    def level3(self):
+        bids = []
+        for price in sorted(self._levels['buy'], reverse=True):
+            for order in self._levels['buy'][price]:
+                bids.append([_format_price(price, self.tick_size),
+                             _format_size(order['size']), order['id']])
+        asks = []
+        for price in sorted(self._levels['sell']):
+            for order in self._levels['sell'][price]:
+                asks.append([_format_price(price, self.tick_size),
+                             _format_size(order['size']), order['id']])
+        return {'sequence': self.sequence, 'bids': bids, 'asks': asks}
+
+    def ticker(self):
+        bid = self.best('buy')
+        ask = self.best('sell')
+        if self.trades:
+            _, price, size = self.trades[-1]
+        else:
+            price, size = self._mid * self.tick_size, 0.0
+        day_ago = time.time() - 86400
+        return {
+            'trade_id': self._trade_id,
+            'price': '{:.2f}'.format(price),
+            'size': '{:.8f}'.format(size),
+            'bid': _format_price(bid or 0, self.tick_size),
+            'ask': _format_price(ask or 0, self.tick_size),
+            'volume': '{:.8f}'.format(sum(t[2] for t in self.trades if t[0] >= day_ago)),
+            'time': _utc_now(),
+        }
+
+    def candles(self, granularity=60):
+        """
+        :return: list
+            [time, low, high, open, close, volume] rows, newest first.
+        """
+        buckets = {}
+        for ts, price, size in self.trades:
+            start = int(ts // granularity * granularity)
+            bar = buckets.get(start)
+            if bar is None:
+                buckets[start] = [start, price, price, price, price, size]
+            else:
+                bar[1] = min(bar[1], price)
+                bar[2] = max(bar[2], price)
+                bar[4] = price
+                bar[5] += size
+        return [
+            [start] + [round(value, 8) for value in buckets[start][1:]]
+            for start in sorted(buckets, reverse=True)
+        ]
+
+
+class _WebsocketConnection(socketserver.BaseRequestHandler):
+    """
+    Minimal RFC 6455 server side connection, text frames out,
+    subscribe/ping/close frames in.
+    """
+
+    def setup(self):
+        self.products = set()
+        self._send_lock = threading.Lock()
+        self.alive = True
+
+    def handle(self):
+        if not self._handshake():
+            return
+        self.server.simulator._add_connection(self)
+        try:
+            while self.alive:
+                frame = self._read_frame()
+                if frame is None:
+                    break
+                opcode, payload = frame
+                if opcode == 0x8:
+                    self._send_frame(b'', opcode=0x8)
+                    break
+                elif opcode == 0x9:
+                    self._send_frame(payload, opcode=0xA)
+                elif opcode == 0x1:
+                    self._on_text(payload.decode('utf-8'))
+        except (socket.error, ValueError):
+            pass
+        finally:
+            self.alive = False
+            self.server.simulator._remove_connection(self)
+
+    def _handshake(self):
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return False
+            data += chunk
+        headers = {}
+        for line in data.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode('ascii')).digest())
+        self.request.sendall(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+        )
+        return True
+
+    def _recv_exactly(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _read_frame(self):
+        header = self._recv_exactly(2)
+        if header is None:
+            return None
+        first, second = struct.unpack('!BB', header)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        # Any read can hit the client disconnecting mid frame
+        if length in (126, 127):
+            extended = self._recv_exactly(2 if length == 126 else 8)
+            if extended is None:
+                return None
+            length, = struct.unpack('!H' if length == 126 else '!Q', extended)
+        mask = None
+        if second & 0x80:
+            mask = self._recv_exactly(4)
+            if mask is None:
+                return None
+        payload = self._recv_exactly(length)
+        if payload is None:
+            return None
+        payload = bytearray(payload)
+        if mask is not None:
+            mask = bytearray(mask)
+            for i in range(len(payload)):
+                payload[i] ^= mask[i % 4]
+        return opcode, bytes(payload)
+
+    def _send_frame(self, payload, opcode=0x1):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        with self._send_lock:
+            self.request.sendall(header + payload)
+
+    def send_text(self, text):
+        try:
+            self._send_frame(text.encode('utf-8'))
+        except socket.error:
+            self.alive = False
+
+    def _on_text(self, text):
+        message = json.loads(text)
+        if message.get('type') != 'subscribe':
+            return
+        products = set(message.get('product_ids') or [])
+        for channel in message.get('channels') or []:
+            if isinstance(channel, dict):
+                products.update(channel.get('product_ids') or [])
+        self.products = products or set(self.server.simulator.products)
+
+
+class _RestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split('/') if p]
+        simulator = self.server.simulator
+        if parts == ['products']:
+            return self._send([{'id': p} for p in simulator.products])
+        if parts == ['time']:
+            return self._send({'iso': _utc_now(), 'epoch': time.time()})
+        if len(parts) != 3 or parts[0] != 'products' or parts[1] not in simulator.products:
+            return self._send({'message': 'NotFound'}, status=404)
+        product_id, endpoint = parts[1], parts[2]
+        with simulator.lock:
+            product = simulator.books[product_id]
+            if endpoint == 'book':
+                level = int(query.get('level', 1))
+                body = product.level3()
+                if level < 3:
+                    # Aggregate to one row per level, top 50 (level 2) or the best (level 1)
+                    depth = 1 if level == 1 else 50
+                    body['bids'] = _aggregate(body['bids'])[:depth]
+                    body['asks'] = _aggregate(body['asks'])[:depth]
+            elif endpoint == 'ticker':
+                body = product.ticker()
+            elif endpoint == 'candles':
+                granularity = int(query.get('granularity', 60))
+                if granularity not in _CANDLE_SIZES:
+                    return self._send({'message': 'Unsupported granularity'}, status=400)
+                body = product.candles(granularity)
+            else:
+                return self._send({'message': 'NotFound'}, status=404)
+        self._send(body)
+
+    def _send(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _aggregate(orders):
+    rows = []
+    for price, size, _ in orders:
+        if rows and rows[-1][0] == price:
+            rows[-1][1] = _format_size(
+                int(round((float(rows[-1][1]) + float(size)) * _UNITS)))
+            rows[-1][2] += 1
+        else:
+            rows.append([price, size, 1])
+    return rows
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class GDAXSimulator(object):
+    """
+    Serves a synthetic GDAX feed on ws_url and REST endpoints on api_url.
+
+    :param products: product ids to simulate
+    :param messages_per_second: feed rate over all products, None for max speed
+    :param seed: order flow seed, the same seed gives the same messages
+    :param gap_probability: chance a message is dropped (sequence gap)
+    :param duplicate_probability: chance a message is sent twice
+    :param burst_interval: seconds between bursts, None disables bursts
+    :param burst_size: messages sent back to back in each burst
+    :param mid_prices: optional {product_id: starting price}
+    :param initial_depth: resting orders per side at start
+    :param port/ws_port: 0 picks free ports
+    """
+
+    def __init__(self, products=GDAX_PAIRS, messages_per_second=100, seed=0,
+                 gap_probability=0.0, duplicate_probability=0.0,
+                 burst_interval=None, burst_size=0, mid_prices=None,
+                 initial_depth=50, host='127.0.0.1', port=0, ws_port=0):
+        self.products = list(products)
+        self.messages_per_second = messages_per_second
+        self.gap_probability = gap_probability
+        self.duplicate_probability = duplicate_probability
+        self.burst_interval = burst_interval
+        self.burst_size = burst_size
+        self.lock = threading.Lock()
+        mid_prices = mid_prices or {}
+        flow_rng = random.Random(seed)
+        # Faults use their own generator so they don't change the order flow
+        self._fault_rng = random.Random(seed + 1)
+        self._product_rng = random.Random(seed + 2)
+        self.books = {
+            product: SyntheticProduct(
+                product,
+                random.Random(flow_rng.getrandbits(64)),
+                mid_price=mid_prices.get(product, 100.0),
+                initial_depth=initial_depth,
+            )
+            for product in self.products
+        }
+        self.stats = {'sent': 0, 'dropped': 0, 'duplicated': 0, 'bursts': 0}
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+        self._rest_server = _ThreadingHTTPServer((host, port), _RestHandler)
+        self._rest_server.simulator = self
+        self._ws_server = _ThreadingTCPServer((host, ws_port), _WebsocketConnection)
+        self._ws_server.simulator = self
+
+    @property
+    def api_url(self):
+        host, port = self._rest_server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def ws_url(self):
+        host, port = self._ws_server.server_address[:2]
+        return 'ws://{}:{}'.format(host, port)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._stop.clear()
+        targets = [
+            self._rest_server.serve_forever,
+            self._ws_server.serve_forever,
+            self._run_feed,
+        ]
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        if self._threads:
+            # shutdown() blocks forever if serve_forever was never called
+            self._rest_server.shutdown()
+            self._ws_server.shutdown()
+        self._rest_server.server_close()
+        self._ws_server.server_close()
+        with self._connections_lock:
+            for connection in list(self._connections):
+                connection.alive = False
+                try:
+                    connection.request.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _add_connection(self, connection):
+        with self._connections_lock:
+            self._connections.add(connection)
+
+    def _remove_connection(self, connection):
+        with self._connections_lock:
+            self._connections.discard(connection)
+
+    def step(self):
+        """
+        Generates and publishes one message.
+        """
+        product = self.books[self._product_rng.choice(self.products)]
+        with self.lock:
+            message = product.next_message()
+        if self._fault_rng.random() < self.gap_probability:
+            self.stats['dropped'] += 1
+            return message
+        copies = 1
+        if self._fault_rng.random() < self.duplicate_probability:
+            self.stats['duplicated'] += 1
+            copies = 2
+        text = json.dumps(message)
+        with self._connections_lock:
+            connections = [c for c in self._connections
+                           if c.alive and message['product_id'] in c.products]
+        for connection in connections:
+            for _ in range(copies):
+                connection.send_text(text)
+        self.stats['sent'] += copies
+        return message
+
+    def _run_feed(self):
+        rate = self.messages_per_second
+        interval = 1.0 / rate if rate else 0.0
+        next_time = time.time()
+        next_burst = time.time() + self.burst_interval if self.burst_interval else None
+        while not self._stop.is_set():
+            if next_burst is not None and time.time() >= next_burst:
+                for _ in range(self.burst_size):
+                    self.step()
+                self.stats['bursts'] += 1
+                next_burst += self.burst_interval
+            self.step()
+            if interval:
+                next_time += interval
+                delay = next_time - time.time()
+                if delay > 0:
+                    self._stop.wait(delay)
+                else:
+                    # Behind schedule, don't try to catch up with a burst
+                    next_time = time.time()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a local GDAX simulator.')
+    parser.add_argument('--products', nargs='+', default=GDAX_PAIRS)
+    parser.add_argument('--rate', type=float, default=100, help='messages per second, 0 for max')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gap-probability', type=float, default=0.0)
+    parser.add_argument('--duplicate-probability', type=float, default=0.0)
+    parser.add_argument('--burst-interval', type=float, default=None)
+    parser.add_argument('--burst-size', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--ws-port', type=int, default=8001)
+    args = parser.parse_args(argv)
+
+    simulator = GDAXSimulator(
+        products=args.products,
+        messages_per_second=args.rate or None,
+        seed=args.seed,
+        gap_probability=args.gap_probability,
+        duplicate_probability=args.duplicate_probability,
+        burst_interval=args.burst_interval,
+        burst_size=args.burst_size,
+        host=args.host,
+        port=args.port,
+        ws_port=args.ws_port,
+    )
+    simulator.start()
+    print('REST {}  websocket {}'.format(simulator.api_url, simulator.ws_url))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
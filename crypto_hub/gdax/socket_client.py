@@ -1,36 +1,114 @@
-import numpy as np
-import pandas as pd
+import os
+import threading
+
 from gdax import WebsocketClient
 
 from crypto_hub.constants import GDAX_PAIRS
+from crypto_hub.lazy import Lazy, lazy_import
 from crypto_hub.gdax.gdax_book import GDAXOrderBook
+from crypto_hub.gdax.instrumentation import instrument_socket_client
 from crypto_hub.gdax.public_client import PublicGDAXClient
-import logbook
 
-log = logbook.Logger(__name__)
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+logbook = lazy_import('logbook')
+
+log = Lazy(lambda: logbook.Logger(__name__), name='logbook.Logger')
 
 
 class GDAXSocketClient(WebsocketClient):
     """
     Websocket Client that maintains and order book
     for each pair subscribed to.
+
+    With a checkpoint_dir the books are restored from their last
+    checkpoint, written on close and by save_checkpoints. GDAX doesn't
+    resend the messages missed while the client was down, so on a live
+    feed a restored book still resyncs from a REST snapshot at the first
+    message, checkpoints only help feeds that can be resumed (e.g. a
+    replayed recording).
     """
 
-    def __init__(self, products=GDAX_PAIRS, mongo_collection=None, should_print=False, **kwargs):
+    def __init__(self, products=GDAX_PAIRS, mongo_collection=None, should_print=False,
+                 metrics=None, api_url=None, checkpoint_dir=None, **kwargs):
         super(GDAXSocketClient, self).__init__(
             products=products,
             mongo_collection=mongo_collection,
             should_print=should_print,
             **kwargs
         )
-        self._public_client = PublicGDAXClient()
+        if api_url is None:
+            self._public_client = PublicGDAXClient()
+        else:
+            self._public_client = PublicGDAXClient(api_url=api_url)
         self.books = {
             product: GDAXOrderBook(
                 product_id=product,
-                public_client=self._public_client
+                public_client=self._public_client,
+                metrics=metrics
             )
             for product in self.products
         }
+        self._metrics = metrics
+        if metrics is not None:
+            instrument_socket_client(self, metrics)
+        # Held while a message is applied so checkpoints never
+        # see a half updated book
+        self._books_lock = threading.Lock()
+        self.checkpoint_dir = checkpoint_dir
+        if checkpoint_dir is not None:
+            self.load_checkpoints()
+
+    def checkpoint_path(self, product):
+        return os.path.join(self._checkpoint_dir(), '{}.ckpt'.format(product))
+
+    def _checkpoint_dir(self):
+        if self.checkpoint_dir is None:
+            raise ValueError('GDAXSocketClient was created without a checkpoint_dir')
+        return self.checkpoint_dir
+
+    def load_checkpoints(self):
+        """
+        Restores the books that have a checkpoint in checkpoint_dir,
+        the others are loaded from a REST snapshot as usual.
+
+        :return: list of restored products
+        """
+        restored = []
+        with self._books_lock:
+            for product, book in self.books.items():
+                path = self.checkpoint_path(product)
+                if os.path.exists(path):
+                    book.load_checkpoint(path)
+                    restored.append(product)
+        return restored
+
+    def save_checkpoints(self):
+        """
+        Writes a checkpoint for every book to checkpoint_dir.
+        Safe to call while the feed is running.
+        """
+        if not os.path.isdir(self._checkpoint_dir()):
+            os.makedirs(self.checkpoint_dir)
+        with self._books_lock:
+            for product, book in self.books.items():
+                book.save_checkpoint(self.checkpoint_path(product))
+
+    def close(self):
+        super(GDAXSocketClient, self).close()
+        if self.checkpoint_dir is None:
+            return
+        # Let the listen thread finish its last message before the final checkpoint
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.save_checkpoints()
+
+    @property
+    def metrics(self):
+        """
+        crypto_hub.metrics.MetricsRegistry passed at init or None.
+        """
+        return self._metrics
 
     @property
     def public_client(self):
@@ -38,7 +116,8 @@ class GDAXSocketClient(WebsocketClient):
 
     def on_message(self, msg):
         try:
-            self.books[msg['product_id']].on_message(msg)
+            with self._books_lock:
+                self.books[msg['product_id']].on_message(msg)
         except KeyError:
             log.error("KeyError in msg: {}".format(msg))
 
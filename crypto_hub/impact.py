@@ -0,0 +1,134 @@
+from crypto_hub.constants import BID, ASK
+from crypto_hub.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+
+def walk_book(prices, sizes, order_sizes):
+    """
+    Fills each order size against the levels, best level first.
+
+    :param prices: array of level prices, best first
+    :param sizes: array of level sizes
+    :param order_sizes: array of order quantities
+    :return: dict of arrays aligned with order_sizes
+        avg_price: average fill price (nan if nothing filled)
+        worst_price: price of the last level touched
+        levels: number of levels consumed
+        filled: quantity filled, less than the order if the book runs out
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    order_sizes = np.asarray(order_sizes, dtype=np.float64)
+    return _walk(prices, np.cumsum(sizes), np.cumsum(prices * sizes), order_sizes)
+
+
+def _walk(prices, cum_size, cum_notional, order_sizes):
+    n = len(prices)
+    if n == 0:
+        nan = np.full(order_sizes.shape, np.nan)
+        return {
+            'avg_price': nan,
+            'worst_price': nan.copy(),
+            'levels': np.zeros(order_sizes.shape, dtype=np.int64),
+            'filled': np.zeros(order_sizes.shape),
+        }
+    filled = np.minimum(order_sizes, cum_size[-1])
+    # First level whose cumulative size covers the order
+    last = np.minimum(np.searchsorted(cum_size, filled, side='left'), n - 1)
+    size_before = np.where(last > 0, cum_size[last - 1], 0.0)
+    notional_before = np.where(last > 0, cum_notional[last - 1], 0.0)
+    notional = notional_before + (filled - size_before) * prices[last]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_price = np.where(filled > 0, notional / filled, np.nan)
+    touched = filled > 0
+    return {
+        'avg_price': avg_price,
+        'worst_price': np.where(touched, prices[last], np.nan),
+        'levels': np.where(touched, last + 1, 0),
+        'filled': filled,
+    }
+
+
+class MarketImpact(object):
+    """
+    Read only walk-the-book queries for a GDAXOrderBook or LimitOrderBook.
+
+    Listens to the book's level updates and rebuilds cumulative depth
+    arrays for a side only when it's queried after a change, so queries
+    never copy the book or simulate orders.
+
+        impact = MarketImpact(book)
+        impact.query(BID, [0.1, 1, 10])  # buy orders, walks the asks
+    """
+
+    def __init__(self, book=None):
+        self._levels = {BID: {}, ASK: {}}
+        self._cache = {BID: None, ASK: None}
+        self._book = None
+        if book is not None:
+            self.attach(book)
+
+    def attach(self, book):
+        self._book = book
+        book.add_listener(self)
+
+    def detach(self):
+        if self._book is not None:
+            self._book.remove_listener(self)
+            self._book = None
+
+    def on_level_update(self, book, side, price, size):
+        price = float(price)
+        size = float(size)
+        if size > 0:
+            self._levels[side][price] = size
+        else:
+            self._levels[side].pop(price, None)
+        self._cache[side] = None
+
+    def on_trade(self, book, side, price, size):
+        pass
+
+    def on_book_reset(self, book):
+        self._levels = {BID: {}, ASK: {}}
+        self._cache = {BID: None, ASK: None}
+
+    def depth(self, book_side):
+        """
+        :param book_side: BID or ASK, the resting side
+        :return: (prices, cumulative sizes, cumulative notional), best level first
+        """
+        cached = self._cache[book_side]
+        if cached is None:
+            levels = self._levels[book_side]
+            prices = np.array(sorted(levels, reverse=book_side == BID), dtype=np.float64)
+            sizes = np.array([levels[p] for p in prices.tolist()], dtype=np.float64)
+            cached = (prices, np.cumsum(sizes), np.cumsum(prices * sizes))
+            self._cache[book_side] = cached
+        return cached
+
+    def query(self, side, order_sizes):
+        """
+        :param side: BID or ASK (buy/sell also accepted), side of the incoming orders
+        :param order_sizes: array of order quantities
+        :return: dict of arrays, see walk_book
+        """
+        book_side = ASK if side in (BID, 'buy') else BID
+        prices, cum_size, cum_notional = self.depth(book_side)
+        order_sizes = np.asarray(order_sizes, dtype=np.float64)
+        return _walk(prices, cum_size, cum_notional, order_sizes)
+
+    def slippage(self, side, order_sizes):
+        """
+        :return: array
+            average fill price relative to the best price, positive is worse.
+        """
+        result = self.query(side, order_sizes)
+        book_side = ASK if side in (BID, 'buy') else BID
+        prices = self.depth(book_side)[0]
+        if not len(prices):
+            return np.full(np.shape(order_sizes), np.nan)
+        best = prices[0]
+        sign = 1.0 if book_side == ASK else -1.0
+        return sign * (result['avg_price'] - best) / best
@@ -0,0 +1,45 @@
+import importlib
+
+
+class Lazy(object):
+    """
+    Proxy that builds its target on first attribute access.
+
+    Used to keep heavy dependencies (pandas, numpy, bintrees, ...)
+    out of module import time:
+
+        pd = lazy_import('pandas')
+        pd.DataFrame(...)  # pandas is imported here
+    """
+
+    def __init__(self, factory, name=None):
+        self.__dict__['_factory'] = factory
+        self.__dict__['_name'] = name
+        self.__dict__['_target'] = None
+
+    def _load(self):
+        target = self.__dict__['_target']
+        if target is None:
+            target = self._factory()
+            self.__dict__['_target'] = target
+        return target
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        if self.__dict__['_target'] is None:
+            return '<Lazy {} (not loaded)>'.format(self._name)
+        return repr(self._target)
+
+
+def lazy_import(name):
+    """
+    :param name: absolute module name
+    :return: Lazy
+        proxy that imports the module on first use
+    """
+    return Lazy(lambda: importlib.import_module(name), name=name)
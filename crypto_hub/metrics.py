@@ -0,0 +1,152 @@
+import time
+from bisect import bisect_left
+
+# Wall clock fallback for python 2
+clock = getattr(time, 'perf_counter', time.time)
+
+# Latency buckets in seconds, 1us to 10s
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class Counter(object):
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram(object):
+    """
+    Fixed bucket histogram.
+
+    counts[i] is the number of observations <= bounds[i],
+    the last count holds everything above the largest bound.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+class MetricsRegistry(object):
+    """
+    Holds counters and histograms keyed by name and labels.
+
+    Labels are tuples of (key, value) pairs. Look the metric up once
+    and keep a reference to it on hot paths:
+
+        counter = registry.counter('messages_total', (('type', 'open'),))
+        counter.inc()
+
+    Updates are not locked, record from a single thread
+    (e.g. the websocket thread) per metric.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+
+    def counter(self, name, labels=()):
+        key = (name, tuple(labels))
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = Counter()
+        return counter
+
+    def histogram(self, name, labels=(), bounds=LATENCY_BUCKETS):
+        key = (name, tuple(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(bounds)
+        return histogram
+
+    def snapshot(self):
+        """
+        :return: dict
+            {'counters': {series: value},
+             'histograms': {series: {'count', 'sum', 'buckets'}}}
+            series are formatted like name{label="value"}
+            and the buckets map upper bounds to cumulative counts.
+        """
+        counters = {
+            _series(name, labels): counter.value
+            for (name, labels), counter in list(self._counters.items())
+        }
+        histograms = {}
+        for (name, labels), histogram in list(self._histograms.items()):
+            bounds = list(histogram.bounds) + [float('inf')]
+            histograms[_series(name, labels)] = {
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': dict(zip(bounds, histogram.cumulative_counts())),
+            }
+        return {'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self):
+        """
+        :return: str
+            metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        seen = set()
+        for (name, labels), counter in sorted(self._counters.items(), key=_sort_key):
+            if name not in seen:
+                lines.append('# TYPE {} counter'.format(name))
+                seen.add(name)
+            lines.append('{} {}'.format(_series(name, labels), _format_value(counter.value)))
+        for (name, labels), histogram in sorted(self._histograms.items(), key=_sort_key):
+            if name not in seen:
+                lines.append('# TYPE {} histogram'.format(name))
+                seen.add(name)
+            bounds = [_format_value(b) for b in histogram.bounds] + ['+Inf']
+            for bound, count in zip(bounds, histogram.cumulative_counts()):
+                series = _series(name + '_bucket', labels + (('le', bound),))
+                lines.append('{} {}'.format(series, count))
+            lines.append('{} {}'.format(_series(name + '_sum', labels), _format_value(histogram.sum)))
+            lines.append('{} {}'.format(_series(name + '_count', labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _sort_key(item):
+    (name, labels), _ = item
+    return name, [(key, str(value)) for key, value in labels]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join(
+        '{}="{}"'.format(key, _escape(value)) for key, value in labels
+    ))
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
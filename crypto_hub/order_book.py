@@ -1,10 +1,14 @@
 from six import iteritems
 from collections import deque
 
-import numpy as np
-import pandas as pd
+from crypto_hub.lazy import lazy_import
+from crypto_hub.checkpoint import write_checkpoint, read_checkpoint
+from crypto_hub.constants import (
+    SATOSHI, BID, ASK, SIZE, PRICE, ORDER_ID, SIDE, TIMESTAMP
+)
 
-from crypto_hub.constants import SATOSHI, BID, ASK, SIZE, PRICE, ORDER_ID, SIDE
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 class LimitOrderBook(object):
@@ -39,6 +43,7 @@ class LimitOrderBook(object):
         self._ask_min = self.price_to_level(max_price)
         self._bid_max = self.price_to_level(tick_size)
         self.fills = []
+        self._listeners = []
 
     @property
     def book(self):
@@ -114,6 +119,43 @@ class LimitOrderBook(object):
         books = self.get_level(level)
         return books[side]
 
+    def add_listener(self, listener):
+        """
+        Registers a listener for level updates.
+
+        listener.on_level_update(book, side, price, size) is called
+        with the new total size whenever a price level changes
+        (0 when the level is empty) and listener.on_trade(book, side, price, size)
+        for every fill, side being the resting order's side.
+
+        The listener is sent the levels already in the book when it's added.
+
+        :param listener: object implementing on_level_update, on_trade and on_book_reset
+        """
+        self._listeners.append(listener)
+        self._send_levels(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _send_levels(self, listener):
+        for level, quotes in list(iteritems(self._book)):
+            for side, orders in iteritems(quotes):
+                size = sum(order[SIZE] for order in orders)
+                if size > 0:
+                    listener.on_level_update(self, side, self.level_to_price(level), size)
+
+    def _level_changed(self, level, side):
+        size = sum(order[SIZE] for order in self.side_at_level(level, side))
+        price = self.level_to_price(level)
+        for listener in self._listeners:
+            listener.on_level_update(self, side, price, size)
+
+    def _traded(self, level, side, size):
+        price = self.level_to_price(level)
+        for listener in self._listeners:
+            listener.on_trade(self, side, price, size)
+
     def relay_fill(self, size, remaining):
         """
         Override this to send fill updates out.
@@ -136,6 +178,8 @@ class LimitOrderBook(object):
             order_list.remove(order)
         except ValueError:
             pass
+        if self._listeners:
+            self._level_changed(level, side)
         return order
 
     def process_order(self, order):
@@ -163,6 +207,26 @@ class LimitOrderBook(object):
         else:
             raise ValueError("Invalid trade side")
 
+    def process_orders(self, orders):
+        """
+        Processes columns of orders in sequence.
+
+        :param orders: mapping of equal length arrays
+            keyed by ORDER_ID, PRICE, SIZE, SIDE and optionally TIMESTAMP.
+        :return: int
+            trade nonce after the last order.
+        """
+        columns = [ORDER_ID, PRICE, SIZE, SIDE]
+        values = [np.asarray(orders[key]).tolist() for key in columns]
+        if TIMESTAMP in orders:
+            # Iterate instead of tolist() so a DatetimeIndex yields
+            # tz aware Timestamps rather than ints
+            columns.append(TIMESTAMP)
+            values.append(list(orders[TIMESTAMP]))
+        for row in zip(*values):
+            self.process_order(dict(zip(columns, row)))
+        return self._trade_nonce
+
     def process_buy(self, order):
         """
         Order filling logic. (Buys)
@@ -207,12 +271,18 @@ class LimitOrderBook(object):
                         fill = orders_to_fill.popleft()
                         self.relay_fill(amount, fill)
                         self.relay_fill(amount, order)
+                        if self._listeners:
+                            self._traded(ask_min, ASK, amount)
+                            self._level_changed(ask_min, ASK)
                         continue
                     # Partially fill a resting order
                     order[SIZE] -= quantity
                     book_entry[SIZE] -= quantity
                     self.relay_fill(quantity, book_entry)
                     self.relay_fill(quantity, order)
+                    if self._listeners:
+                        self._traded(ask_min, ASK, quantity)
+                        self._level_changed(ask_min, ASK)
                     self._trade_nonce += 1
                     return self._trade_nonce
                 self._ask_min += 1
@@ -224,6 +294,8 @@ class LimitOrderBook(object):
             self._orders_by_id[order_id] = order
         if self._bid_max < level:
             self._bid_max = level
+        if self._listeners:
+            self._level_changed(level, BID)
         return self._trade_nonce
 
     def process_sell(self, order):
@@ -251,12 +323,18 @@ class LimitOrderBook(object):
                         fill = orders_to_fill.popleft()
                         self.relay_fill(amount, fill)
                         self.relay_fill(amount, order)
+                        if self._listeners:
+                            self._traded(bid_max, BID, amount)
+                            self._level_changed(bid_max, BID)
                         continue
                     # Partially fill a resting order
                     order[SIZE] -= quantity
                     book_entry[SIZE] -= quantity
                     self.relay_fill(quantity, book_entry)
                     self.relay_fill(quantity, order)
+                    if self._listeners:
+                        self._traded(bid_max, BID, quantity)
+                        self._level_changed(bid_max, BID)
                     self._trade_nonce += 1
                     return self._trade_nonce
                 self._bid_max -= 1
@@ -267,4 +345,88 @@ class LimitOrderBook(object):
             self._orders_by_id[order_id] = order
         if self._ask_min > level:
             self._ask_min = level
+        if self._listeners:
+            self._level_changed(level, ASK)
         return self._trade_nonce
+
+    def save_checkpoint(self, path):
+        """
+        Writes the resting orders and book pointers to a columnar binary file.
+
+        Only the order protocol keys (order_id, price, size, side) are kept.
+        Integer order ids are restored as ints, any other ids as strings.
+
+        :param path: checkpoint file, see crypto_hub.checkpoint
+        """
+        levels, prices, sizes, sides, order_ids = [], [], [], [], []
+        for level in sorted(self._book):
+            quotes = self._book[level]
+            for side_flag, side in enumerate((BID, ASK)):
+                for order in quotes[side]:
+                    levels.append(level)
+                    prices.append(order[PRICE])
+                    sizes.append(order[SIZE])
+                    sides.append(side_flag)
+                    order_ids.append(order.get(ORDER_ID))
+        if all(isinstance(i, int) and not isinstance(i, bool) for i in order_ids):
+            id_kind = 'int'
+            ids = np.array(order_ids, dtype=np.int64)
+        else:
+            id_kind = 'str'
+            ids = np.array([u'' if i is None else u'{}'.format(i) for i in order_ids], dtype=np.str_)
+        write_checkpoint(path, [
+            ('level', np.array(levels, dtype=np.int64)),
+            ('price', np.array(prices, dtype=np.float64)),
+            ('size', np.array(sizes, dtype=np.float64)),
+            ('side', np.array(sides, dtype=np.uint8)),
+            ('order_id', ids),
+        ], meta={
+            'kind': 'LimitOrderBook',
+            'tick_size': self.tick_size,
+            'max_level': self.max_level,
+            'ask_min': self._ask_min,
+            'bid_max': self._bid_max,
+            'trade_nonce': self._trade_nonce,
+            'id_kind': id_kind,
+        })
+
+    def load_checkpoint(self, path, mmap=True):
+        """
+        Replaces the book state with a checkpoint written by save_checkpoint.
+
+        Listeners are sent on_book_reset followed by the restored levels.
+
+        :param path: checkpoint file
+        :param mmap: memory map the file instead of reading it
+        """
+        columns, meta = read_checkpoint(path, mmap=mmap)
+        if meta.get('kind') != 'LimitOrderBook':
+            raise ValueError('{} is not a LimitOrderBook checkpoint'.format(path))
+        self.tick_size = meta['tick_size']
+        self.max_level = meta['max_level']
+        self._ask_min = meta['ask_min']
+        self._bid_max = meta['bid_max']
+        self._trade_nonce = meta['trade_nonce']
+        self._book = {}
+        self._orders_by_id = {}
+        order_ids = columns['order_id'].tolist()
+        if meta['id_kind'] == 'str':
+            order_ids = [i or None for i in order_ids]
+        rows = zip(
+            columns['level'].tolist(),
+            columns['price'].tolist(),
+            columns['size'].tolist(),
+            columns['side'].tolist(),
+            order_ids,
+        )
+        sides = (BID, ASK)
+        for level, price, size, side_flag, order_id in rows:
+            side = sides[side_flag]
+            order = {PRICE: price, SIZE: size, SIDE: side}
+            if order_id is not None:
+                order[ORDER_ID] = order_id
+                self._orders_by_id[order_id] = order
+            self.side_at_level(level, side).append(order)
+        for listener in self._listeners:
+            listener.on_book_reset(self)
+            self._send_levels(listener)